@@ -1,120 +1,418 @@
 import asyncio
-from pathlib import Path
-from typing import Optional
+import gc
+import io
+import os
+import re
+import struct
+import tempfile
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from itertools import repeat
+from typing import Any, BinaryIO, Dict, Iterable, List, Optional, Union
 import logging
+import multiprocessing
+
+try:
+    import fitz  # type: ignore  # PyMuPDF
+except ImportError:
+    fitz = None  # Fall back to PyPDF2
+
+# Pin the flags get_text("text") uses by default today, so page text output
+# doesn't change if a PyMuPDF upgrade changes its defaults
+PDF_TEXT_FLAGS = fitz.TEXTFLAGS_TEXT if fitz else 0
 
 logger = logging.getLogger(__name__)
 
+# WordprocessingML element tags used when streaming word/document.xml
+_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_W_P = f"{_W_NS}p"
+_W_T = f"{_W_NS}t"
+_W_TAB = f"{_W_NS}tab"
+_W_BR = f"{_W_NS}br"
+_W_CR = f"{_W_NS}cr"
+_W_VAL = f"{_W_NS}val"
+# Text box content is skipped like python-docx does; Word also stores each
+# box a second time under mc:Fallback for older readers
+_W_TXBX_CONTENT = f"{_W_NS}txbxContent"
+_MC_FALLBACK = "{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback"
+
+# Word 97-2003 binary format: offsets into the FIB at the start of the
+# WordDocument stream, and piece table flags
+_FIB_FLAGS = 0x000A
+_FIB_CCP_TEXT = 0x004C
+_FIB_FC_CLX = 0x01A2
+_FIB_ENCRYPTED = 0x0100
+_FIB_WHICH_TABLE = 0x0200
+_FC_COMPRESSED = 0x40000000
+
+# Field begin, separator and end marks: \x13 code \x14 result \x15
+_DOC_FIELD_MARK = re.compile("[\x13\x14\x15]")
+
+# Paragraph, line and page breaks become newlines, cell marks become tabs,
+# and remaining control characters (object anchors and the like) are dropped
+_DOC_CONTROL_CHARS: Dict[int, Optional[str]] = {code: None for code in range(32) if code not in (9, 10)}
+_DOC_CONTROL_CHARS.update({0x0D: "\n", 0x0B: "\n", 0x0C: "\n", 0x07: "\t"})
+
+# Number of worker processes used to extract PDF pages in parallel
+PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", str(os.cpu_count() or 1)))
+# PDFs with fewer pages are extracted in-process; below this the pickling and
+# IPC cost of the process pool outweighs the per-page extraction time
+PDF_PARSE_MIN_PAGES = int(os.getenv("PDF_PARSE_MIN_PAGES", "32"))
+# In-memory PDFs up to this size are sent to worker processes as bytes; larger
+# ones are written to a named temp file that the workers open by path instead
+PDF_INLINE_SIZE = 4 << 20
+
+_pdf_executor: Optional[ProcessPoolExecutor] = None
+_pdf_executor_lock = threading.Lock()
+
+
+def _get_pdf_executor() -> ProcessPoolExecutor:
+    """Lazily create the process pool shared by all PDF extractions"""
+    global _pdf_executor
+    with _pdf_executor_lock:
+        if _pdf_executor is None:
+            # The pool is created from a parser thread of a multi-threaded
+            # server, which fork() can't copy safely; start workers from a
+            # single-threaded fork server instead
+            mp_context = multiprocessing.get_context("forkserver")
+            mp_context.set_forkserver_preload([__name__])
+            _pdf_executor = ProcessPoolExecutor(max_workers=PDF_PARSE_WORKERS, mp_context=mp_context)
+        return _pdf_executor
+
+
+def shutdown_pdf_executor() -> None:
+    """Stop the PDF worker processes, if the pool was ever started"""
+    global _pdf_executor
+    with _pdf_executor_lock:
+        if _pdf_executor is not None:
+            _pdf_executor.shutdown(wait=True, cancel_futures=True)
+            _pdf_executor = None
+
+
+def _extract_pages(doc: "fitz.Document", start: int, stop: int) -> List[str]:
+    """Extract text from pages [start, stop) of an open PyMuPDF document"""
+    text_parts = []
+    for page_num in range(start, stop):
+        try:
+            text = doc[page_num].get_text("text", flags=PDF_TEXT_FLAGS)
+            # Skip blank pages; isspace() checks without copying like strip()
+            if text and not text.isspace():
+                text_parts.append(text)
+        except Exception as e:
+            logger.warning(f"Error extracting text from page {page_num + 1}: {e}")
+    
+    return text_parts
+
+
+def _disk_path(file_obj: BinaryIO) -> Optional[str]:
+    """Path any local process can open to read file_obj, or None if it is held in memory"""
+    name = getattr(file_obj, "name", None)
+    if isinstance(name, str):
+        return name if os.path.isfile(name) else None
+    if isinstance(name, int):
+        # Anonymous temp files, such as a SpooledTemporaryFile that rolled
+        # over to disk, are only reachable through this process's fd table
+        path = f"/proc/{os.getpid()}/fd/{name}"
+        return path if os.path.exists(path) else None
+    return None
+
+
+def _open_pdf(source: Union[bytes, str]) -> "fitz.Document":
+    """Open a PDF from in-memory bytes or a file path"""
+    if isinstance(source, bytes):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source, filetype="pdf")
+
+
+def _strip_field_codes(text: str) -> str:
+    """Drop DOC field codes but keep field results, for fields nested to any depth"""
+    buffer = io.StringIO()
+    # One entry per open field, True while it is still in its code section
+    fields: List[bool] = []
+    in_code = 0
+    pos = 0
+    for match in _DOC_FIELD_MARK.finditer(text):
+        if not in_code:
+            buffer.write(text[pos:match.start()])
+        pos = match.end()
+        mark = match.group()
+        if mark == "\x13":
+            fields.append(True)
+            in_code += 1
+        elif fields:
+            # A separator or an end closes the innermost field's code section
+            if fields[-1]:
+                fields[-1] = False
+                in_code -= 1
+            if mark == "\x15":
+                fields.pop()
+    if not in_code:
+        buffer.write(text[pos:])
+    
+    return buffer.getvalue()
+
+
+def _extract_page_range(source: Union[bytes, str], start: int, stop: int) -> List[str]:
+    """Extract text from pages [start, stop) of a PDF (runs in a worker process)"""
+    doc = _open_pdf(source)
+    try:
+        return _extract_pages(doc, start, stop)
+    finally:
+        doc.close()
+
 
 class DocumentParser:
     """Parser for various document formats"""
     
-    async def parse_document(self, file_path: Path, file_ext: str) -> str:
+    async def parse_document(self, file_obj: BinaryIO, file_ext: str) -> str:
         """
         Parse document and extract text content.
         
         Args:
-            file_path: Path to the document file
+            file_obj: Seekable binary file object holding the document
             file_ext: File extension (e.g., '.pdf', '.docx', '.doc')
         
         Returns:
             Extracted text content
         """
         file_ext = file_ext.lower()
+        file_obj.seek(0)
         
         if file_ext == '.pdf':
-            return await self._parse_pdf(file_path)
+            return await self._parse_pdf(file_obj)
         elif file_ext == '.docx':
-            return await self._parse_docx(file_path)
+            return await self._parse_docx(file_obj)
         elif file_ext == '.doc':
-            return await self._parse_doc(file_path)
+            return await self._parse_doc(file_obj)
         else:
             raise ValueError(f"Unsupported file type: {file_ext}")
     
-    async def _parse_pdf(self, file_path: Path) -> str:
+    async def _parse_pdf(self, file_obj: BinaryIO) -> str:
         """Parse PDF file"""
         try:
-            import PyPDF2
+            if fitz is None:
+                import PyPDF2
             
             # Run in thread pool to avoid blocking
             loop = asyncio.get_event_loop()
             text = await loop.run_in_executor(
                 None,
                 self._extract_pdf_text,
-                file_path
+                file_obj
             )
             return text
         except ImportError:
             raise ImportError(
-                "PyPDF2 is required for PDF parsing. Install it with: pip install PyPDF2"
+                "PyMuPDF or PyPDF2 is required for PDF parsing. Install it with: pip install PyMuPDF"
             )
         except Exception as e:
             logger.error(f"PDF parsing error: {e}")
             raise Exception(f"Failed to parse PDF: {str(e)}")
     
-    def _extract_pdf_text(self, file_path: Path) -> str:
+    def _extract_pdf_text(self, file_obj: BinaryIO) -> str:
         """Synchronous PDF text extraction"""
+        if fitz is None:
+            return self._extract_pdf_text_pypdf2(file_obj)
+        
+        # Uploads already on disk are opened in place; only in-memory ones are read
+        source: Union[bytes, str]
+        path = _disk_path(file_obj)
+        if path is None:
+            source = file_obj.read()
+        else:
+            file_obj.flush()
+            source = path
+        
+        results: Iterable[List[str]]
+        with ExitStack() as stack:
+            doc = _open_pdf(source)
+            try:
+                page_count = doc.page_count
+                workers = min(PDF_PARSE_WORKERS, page_count)
+                if workers > 1 and page_count >= PDF_PARSE_MIN_PAGES:
+                    if isinstance(source, bytes) and len(source) > PDF_INLINE_SIZE:
+                        # Write large in-memory PDFs out once rather than
+                        # sending every worker its own copy
+                        spill = stack.enter_context(tempfile.NamedTemporaryFile(suffix=".pdf"))
+                        spill.write(source)
+                        spill.flush()
+                        source = spill.name
+                    # Split pages into one contiguous range per worker so each
+                    # process opens the document only once
+                    step = -(-page_count // workers)
+                    starts = range(0, page_count, step)
+                    stops = [min(start + step, page_count) for start in starts]
+                    results = _get_pdf_executor().map(_extract_page_range, repeat(source), starts, stops)
+                else:
+                    results = [_extract_pages(doc, 0, page_count)]
+            finally:
+                doc.close()
+            
+            # Assemble pages incrementally rather than joining one large list
+            buffer = io.StringIO()
+            for text_parts in results:
+                for text in text_parts:
+                    if buffer.tell():
+                        buffer.write("\n\n")
+                    buffer.write(text)
+        
+        return buffer.getvalue()
+    
+    def _extract_pdf_text_pypdf2(self, file_obj: BinaryIO) -> str:
+        """Synchronous PDF text extraction using PyPDF2 (fallback)"""
         import PyPDF2
         
-        text_parts = []
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
+        buffer = io.StringIO()
+        # PyPDF2 annotates pages as a list but returns a lazy sequence; keep it
+        # untyped so a mypyc build doesn't insert a list type check
+        pdf_reader: Any = PyPDF2.PdfReader(file_obj)
+        try:
             for page_num, page in enumerate(pdf_reader.pages):
                 try:
                     text = page.extract_text()
-                    if text:
-                        text_parts.append(text)
+                    if text and not text.isspace():
+                        if buffer.tell():
+                            buffer.write("\n\n")
+                        buffer.write(text)
                 except Exception as e:
                     logger.warning(f"Error extracting text from page {page_num + 1}: {e}")
+        finally:
+            # The reader's parsed object tables form reference cycles; collect
+            # them now instead of letting worker memory grow until the next GC
+            page = pdf_reader = None
+            gc.collect()
         
-        return "\n\n".join(text_parts)
+        return buffer.getvalue()
     
-    async def _parse_docx(self, file_path: Path) -> str:
+    async def _parse_docx(self, file_obj: BinaryIO) -> str:
         """Parse DOCX file"""
         try:
-            from docx import Document
-            
             loop = asyncio.get_event_loop()
             text = await loop.run_in_executor(
                 None,
                 self._extract_docx_text,
-                file_path
+                file_obj
             )
             return text
-        except ImportError:
-            raise ImportError(
-                "python-docx is required for DOCX parsing. Install it with: pip install python-docx"
-            )
         except Exception as e:
             logger.error(f"DOCX parsing error: {e}")
             raise Exception(f"Failed to parse DOCX: {str(e)}")
     
-    def _extract_docx_text(self, file_path: Path) -> str:
+    def _extract_docx_text(self, file_obj: BinaryIO) -> str:
         """Synchronous DOCX text extraction"""
-        from docx import Document
+        # Stream word/document.xml instead of building the full lxml tree.
+        # Every finished element is detached from its parent, so the tree
+        # only ever holds the elements still open at the current position
+        paragraphs = []
+        runs = []
+        open_elements: List[ET.Element] = []
+        paragraph_depth = 0
+        skip_depth = 0
+        with zipfile.ZipFile(file_obj) as archive, archive.open("word/document.xml") as xml_file:
+            for event, elem in ET.iterparse(xml_file, events=("start", "end")):
+                tag = elem.tag
+                if event == "start":
+                    if tag == _W_TXBX_CONTENT or tag == _MC_FALLBACK:
+                        skip_depth += 1
+                    elif tag == _W_P and not skip_depth:
+                        paragraph_depth += 1
+                    open_elements.append(elem)
+                    continue
+                
+                open_elements.pop()
+                if open_elements:
+                    open_elements[-1].remove(elem)
+                
+                if tag == _W_TXBX_CONTENT or tag == _MC_FALLBACK:
+                    skip_depth -= 1
+                elif skip_depth:
+                    continue
+                elif tag == _W_T:
+                    if elem.text:
+                        runs.append(elem.text)
+                elif tag == _W_TAB and _W_VAL not in elem.attrib:
+                    # Tab characters in runs; tab stop definitions carry w:val
+                    runs.append("\t")
+                elif tag == _W_BR or tag == _W_CR:
+                    runs.append("\n")
+                elif tag == _W_P:
+                    # Only the outermost paragraph ends a run of text
+                    paragraph_depth -= 1
+                    if paragraph_depth:
+                        continue
+                    text = "".join(runs)
+                    runs.clear()
+                    if text and not text.isspace():
+                        paragraphs.append(text)
         
-        doc = Document(file_path)
-        paragraphs = [para.text for para in doc.paragraphs if para.text.strip()]
         return "\n\n".join(paragraphs)
     
-    async def _parse_doc(self, file_path: Path) -> str:
+    async def _parse_doc(self, file_obj: BinaryIO) -> str:
         """Parse DOC file (older Microsoft Word format)"""
         try:
-            import textract
+            import olefile  # type: ignore
             
             loop = asyncio.get_event_loop()
             text = await loop.run_in_executor(
                 None,
-                textract.process,
-                str(file_path)
+                self._extract_doc_text,
+                file_obj
             )
-            # textract returns bytes, decode to string
-            return text.decode('utf-8', errors='ignore')
+            return text
         except ImportError:
             raise ImportError(
-                "textract is required for DOC parsing. Install it with: pip install textract"
+                "olefile is required for DOC parsing. Install it with: pip install olefile"
             )
         except Exception as e:
             logger.error(f"DOC parsing error: {e}")
             raise Exception(f"Failed to parse DOC: {str(e)}")
-
+    
+    def _extract_doc_text(self, file_obj: BinaryIO) -> str:
+        """Synchronous DOC text extraction"""
+        import olefile  # type: ignore
+        
+        with olefile.OleFileIO(file_obj) as ole:
+            word = ole.openstream("WordDocument").read()
+            flags = struct.unpack_from("<H", word, _FIB_FLAGS)[0]
+            if flags & _FIB_ENCRYPTED:
+                raise ValueError("Encrypted DOC files are not supported")
+            table = ole.openstream("1Table" if flags & _FIB_WHICH_TABLE else "0Table").read()
+        
+        ccp_text = struct.unpack_from("<i", word, _FIB_CCP_TEXT)[0]
+        fc_clx, lcb_clx = struct.unpack_from("<II", word, _FIB_FC_CLX)
+        clx = table[fc_clx:fc_clx + lcb_clx]
+        
+        # Skip formatting (Prc) entries to reach the piece table (Pcdt)
+        pos = 0
+        while pos < len(clx) and clx[pos] == 0x01:
+            pos += 3 + struct.unpack_from("<H", clx, pos + 1)[0]
+        if pos >= len(clx) or clx[pos] != 0x02:
+            raise ValueError("DOC piece table not found")
+        lcb_plc = struct.unpack_from("<I", clx, pos + 1)[0]
+        plc = clx[pos + 5:pos + 5 + lcb_plc]
+        
+        # PlcPcd: piece_count + 1 character positions, then 8-byte piece descriptors
+        piece_count = (lcb_plc - 4) // 12
+        cps = struct.unpack_from(f"<{piece_count + 1}I", plc)
+        pcd_offset = 4 * (piece_count + 1)
+        
+        buffer = io.StringIO()
+        for index in range(piece_count):
+            start = cps[index]
+            if start >= ccp_text:
+                break
+            length = min(cps[index + 1], ccp_text) - start
+            fc = struct.unpack_from("<I", plc, pcd_offset + 8 * index + 2)[0]
+            if fc & _FC_COMPRESSED:
+                # 8-bit text stored at half the recorded offset
+                offset = (fc & ~_FC_COMPRESSED) // 2
+                buffer.write(word[offset:offset + length].decode("cp1252", errors="replace"))
+            else:
+                buffer.write(word[fc:fc + 2 * length].decode("utf-16-le", errors="replace"))
+        
+        text = _strip_field_codes(buffer.getvalue())
+        paragraphs = [para for para in text.translate(_DOC_CONTROL_CHARS).split("\n") if para and not para.isspace()]
+        return "\n\n".join(paragraphs)
@@ -1,13 +1,25 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
-import aiofiles
+from fastapi.responses import ORJSONResponse, StreamingResponse
+import json
+import orjson
 import os
+import re
+import tempfile
 from pathlib import Path
-from typing import Optional
+from typing import AsyncGenerator, AsyncIterator, List, Optional, Tuple
+from diskcache import Cache
 import httpx
 import logging
 
-from document_parser import DocumentParser
+from document_parser import DocumentParser, shutdown_pdf_executor
+
+# Prefer BLAKE3 for hashing uploads; fall back to SHA-256 from the stdlib
+try:
+    from blake3 import blake3 as content_hasher
+except ImportError:
+    from hashlib import sha256 as content_hasher
 
 # Load environment variables from .env file if it exists
 try:
@@ -20,17 +32,96 @@ except ImportError:
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Local Ollama Document Summarizer", version="1.0.0")
+app = FastAPI(
+    title="Local Ollama Document Summarizer",
+    version="1.0.0",
+    default_response_class=ORJSONResponse
+)
 
 # Configuration
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "deepseek-r1")
-UPLOAD_DIR = Path("uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
+UPLOAD_CHUNK_SIZE = 1 << 20  # Read uploads in 1 MiB chunks
+UPLOAD_SPOOL_SIZE = 50 << 20  # Uploads are kept in memory up to 50 MiB, then spill to a temp file
+SUMMARY_CACHE_DIR = os.getenv("SUMMARY_CACHE_DIR", ".summary_cache")
+SUMMARY_CACHE_SIZE_MB = int(os.getenv("SUMMARY_CACHE_SIZE_MB", "256"))
+# Size of the default executor used for document parsing. This is per
+# worker process: with `uvicorn --workers N` the total is N * THREAD_POOL_SIZE
+THREAD_POOL_SIZE = int(os.getenv("THREAD_POOL_SIZE", "32"))
+SUMMARY_CHUNK_SIZE = 4000  # Characters per chunk sent to Ollama for long documents
+SUMMARY_CHUNK_OVERLAP = 200  # Characters shared between consecutive chunks
+OLLAMA_CONCURRENCY = int(os.getenv("OLLAMA_CONCURRENCY", "2"))
+MIN_SUMMARY_CHARS = 500  # Shorter documents are returned as-is instead of summarized
+MIN_UNIQUE_WORDS = 50  # Documents with fewer distinct words are truncated instead of summarized
+WORD_PATTERN = re.compile(r"\S+")
+
+
+def json_string(text: str) -> bytes:
+    """JSON-encode text, replacing lone surrogates that orjson rejects"""
+    try:
+        return orjson.dumps(text)
+    except TypeError:
+        # PyPDF2 can decode broken text into unpaired surrogates
+        return orjson.dumps(text.encode("utf-8", "replace").decode())
+
+
+def json_fragment(text: str) -> bytes:
+    """JSON-escape text, without the surrounding quotes"""
+    return json_string(text)[1:-1]
+
+
+# Prompt pieces, JSON-escaped once at import so each request only escapes the document text
+DOCUMENT_PROMPT_PREFIX = json_fragment("Please provide a concise summary of the following document.")
+DOCUMENT_PROMPT_BODY = json_fragment("\n\nDocument:\n")
+SECTION_PROMPT_PREFIX = json_fragment(
+    "Please provide a concise summary of the following section of a document.\n\nSection:\n"
+)
+REDUCE_PROMPT_PREFIX = json_fragment(
+    "The following are summaries of consecutive sections of one document. "
+    "Combine them into a single concise summary of the whole document."
+)
+REDUCE_PROMPT_BODY = json_fragment("\n\nSection summaries:\n")
+PROMPT_SUFFIX = json_fragment("\n\nSummary:")
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# A JSON-escaped prompt kept as (instruction, text, suffix) pieces until the request body is built
+Prompt = Tuple[bytes, memoryview, bytes]
+
 
 # Initialize document parser
 parser = DocumentParser()
 
+# Caps in-flight Ollama generations; extra requests wait here instead of piling up in Ollama
+OLLAMA_SEMAPHORE = asyncio.Semaphore(OLLAMA_CONCURRENCY)
+
+# Summaries keyed by (content hash, model, max_length), evicted least-recently-used
+summary_cache = Cache(
+    SUMMARY_CACHE_DIR,
+    size_limit=SUMMARY_CACHE_SIZE_MB << 20,
+    eviction_policy="least-recently-used"
+)
+
+
+@app.on_event("startup")
+async def startup():
+    # Dedicated, larger pool for run_in_executor(None, ...) parsing calls
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=THREAD_POOL_SIZE, thread_name_prefix="parser")
+    )
+    
+    # One pooled client for all Ollama calls so connections are kept alive
+    app.state.http = httpx.AsyncClient(
+        base_url=OLLAMA_BASE_URL,
+        timeout=120.0,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+    )
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await app.state.http.aclose()
+    shutdown_pdf_executor()
+
 
 @app.get("/")
 async def root():
@@ -48,9 +139,8 @@ async def root():
 async def health():
     """Check API and Ollama connection health"""
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.get(f"{OLLAMA_BASE_URL}/api/tags")
-            ollama_status = response.status_code == 200
+        response = await app.state.http.get("/api/tags", timeout=5.0)
+        ollama_status = response.status_code == 200
     except Exception as e:
         logger.error(f"Ollama connection error: {e}")
         ollama_status = False
@@ -66,16 +156,15 @@ async def health():
 async def list_models():
     """List available Ollama models"""
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(f"{OLLAMA_BASE_URL}/api/tags")
-            if response.status_code == 200:
-                models = response.json().get("models", [])
-                return {
-                    "models": [model.get("name", "") for model in models],
-                    "current_model": OLLAMA_MODEL
-                }
-            else:
-                raise HTTPException(status_code=500, detail="Failed to fetch models")
+        response = await app.state.http.get("/api/tags", timeout=10.0)
+        if response.status_code == 200:
+            models = response.json().get("models", [])
+            return {
+                "models": [model.get("name", "") for model in models],
+                "current_model": OLLAMA_MODEL
+            }
+        else:
+            raise HTTPException(status_code=500, detail="Failed to fetch models")
     except httpx.RequestError as e:
         raise HTTPException(status_code=503, detail=f"Cannot connect to Ollama: {str(e)}")
 
@@ -84,7 +173,8 @@ async def list_models():
 async def summarize_document(
     file: UploadFile = File(...),
     model: Optional[str] = None,
-    max_length: Optional[int] = None
+    max_length: Optional[int] = None,
+    stream: bool = False
 ):
     """
     Upload a document and get its summary using Ollama.
@@ -95,6 +185,7 @@ async def summarize_document(
     - file: The document file to summarize
     - model: Optional Ollama model name (defaults to OLLAMA_MODEL env var or 'llama2')
     - max_length: Optional maximum summary length in words (use -1, 0, or omit for unlimited)
+    - stream: Stream the summary as plain text while Ollama generates it instead of returning JSON
     """
     # Validate file type
     file_ext = Path(file.filename).suffix.lower()
@@ -107,18 +198,43 @@ async def summarize_document(
     # Use provided model or default
     model_name = model or OLLAMA_MODEL
     
-    # Save uploaded file temporarily
-    file_path = UPLOAD_DIR / file.filename
+    # Normalize max_length: treat -1, 0, and None as unlimited
+    normalized_max_length = None if (max_length is None or max_length <= 0) else max_length
+    
+    # Buffer the upload for parsing, hashing and sizing it as it streams in
+    upload = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE)
     try:
-        async with aiofiles.open(file_path, 'wb') as f:
-            content = await file.read()
-            await f.write(content)
+        hasher = content_hasher()
+        upload_size = 0
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            hasher.update(chunk)
+            upload_size += len(chunk)
+            upload.write(chunk)
+        
+        if upload_size == 0:
+            raise HTTPException(status_code=400, detail="Uploaded file is empty")
         
-        logger.info(f"Processing file: {file.filename}")
+        # Identical content summarized with the same settings: skip parse and Ollama
+        cache_key = (hasher.hexdigest(), model_name, normalized_max_length)
+        cached = await cache_get(cache_key)
+        if cached is not None:
+            logger.info(f"Summary cache hit: {file.filename}")
+            if stream:
+                return StreamingResponse(iter([cached["summary"]]), media_type="text/plain")
+            return ORJSONResponse(content={
+                "filename": file.filename,
+                "file_type": file_ext,
+                "model": model_name,
+                "original_length": cached["original_length"],
+                "summary": cached["summary"],
+                "summary_length": len(cached["summary"])
+            })
+        
+        logger.info(f"Processing file: {file.filename} ({upload_size} bytes)")
         
         # Parse document
         try:
-            text_content = await parser.parse_document(file_path, file_ext)
+            text_content = await parser.parse_document(upload, file_ext)
             if not text_content or not text_content.strip():
                 raise HTTPException(
                     status_code=400,
@@ -131,11 +247,20 @@ async def summarize_document(
                 detail=f"Failed to parse document: {str(e)}"
             )
         
-        # Normalize max_length: treat -1, 0, and None as unlimited
-        normalized_max_length = None if (max_length is None or max_length <= 0) else max_length
-        
         # Generate summary using Ollama
         try:
+            if stream and summary_within_budget(text_content, normalized_max_length) is None:
+                prompt = await build_summary_prompt(text_content, model_name, normalized_max_length)
+                # Wait for the first token so Ollama errors still surface as an error status
+                tokens = ollama_generate_stream(model_name, prompt)
+                try:
+                    first_token = await anext(tokens)
+                except StopAsyncIteration:
+                    raise Exception("Empty response from Ollama")
+                return StreamingResponse(
+                    stream_summary(tokens, first_token, cache_key, len(text_content)),
+                    media_type="text/plain"
+                )
             summary = await generate_summary(text_content, model_name, normalized_max_length)
         except Exception as e:
             logger.error(f"Summary generation error: {e}")
@@ -144,7 +269,14 @@ async def summarize_document(
                 detail=f"Failed to generate summary: {str(e)}"
             )
         
-        return JSONResponse(content={
+        await cache_set(cache_key, {
+            "original_length": len(text_content),
+            "summary": summary
+        })
+        
+        if stream:
+            return StreamingResponse(iter([summary]), media_type="text/plain")
+        return ORJSONResponse(content={
             "filename": file.filename,
             "file_type": file_ext,
             "model": model_name,
@@ -154,56 +286,262 @@ async def summarize_document(
         })
     
     finally:
-        # Clean up uploaded file
-        if file_path.exists():
-            file_path.unlink()
-            logger.info(f"Cleaned up file: {file_path}")
+        upload.close()
+
+
+async def cache_get(key: tuple) -> Optional[dict]:
+    """Look up a cached summary without blocking the event loop on SQLite"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, summary_cache.get, key)
+
+
+async def cache_set(key: tuple, value: dict) -> None:
+    """Store a summary without blocking the event loop on SQLite"""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, summary_cache.set, key, value)
+
+
+def split_text(
+    text: str,
+    chunk_size: int = SUMMARY_CHUNK_SIZE,
+    overlap: int = SUMMARY_CHUNK_OVERLAP
+) -> List[str]:
+    """Split text into overlapping chunks, preferring paragraph, line, sentence and word boundaries"""
+    chunks = []
+    start = 0
+    text_length = len(text)
+    while start < text_length:
+        end = min(start + chunk_size, text_length)
+        if end < text_length:
+            # Break at the last natural boundary in the back half of the window
+            for separator in ("\n\n", "\n", ". ", " "):
+                cut = text.rfind(separator, start + chunk_size // 2, end)
+                if cut != -1:
+                    end = cut + len(separator)
+                    break
+        chunks.append(text[start:end])
+        if end >= text_length:
+            break
+        start = max(end - overlap, start + 1)
+    
+    return chunks
 
 
 async def generate_summary(text: str, model: str, max_length: Optional[int] = None) -> str:
     """Generate summary using Ollama API"""
+    summary = summary_within_budget(text, max_length)
+    if summary is not None:
+        logger.info("Document is already within the summary budget; skipping Ollama")
+        return summary
     
-    # Truncate text if too long (Ollama has context limits)
-    max_chars = 8000  # Conservative limit
-    if len(text) > max_chars:
-        text = text[:max_chars] + "... [truncated]"
-        logger.warning(f"Text truncated to {max_chars} characters")
-    
-    # Create prompt
-    length_instruction = f" Keep the summary under {max_length} words." if max_length else ""
-    prompt = f"""Please provide a concise summary of the following document.{length_instruction}
-
-Document:
-{text}
-
-Summary:"""
-    
-    # Call Ollama API
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        response = await client.post(
-            f"{OLLAMA_BASE_URL}/api/generate",
-            json={
-                "model": model,
-                "prompt": prompt,
-                "stream": False
-            }
-        )
-        
-        if response.status_code != 200:
-            error_msg = response.text
-            logger.error(f"Ollama API error: {error_msg}")
-            raise Exception(f"Ollama API returned status {response.status_code}: {error_msg}")
-        
-        result = response.json()
-        summary = result.get("response", "").strip()
+    prompt = await build_summary_prompt(text, model, max_length)
+    return await ollama_generate(model, prompt)
+
+
+def summary_within_budget(text: str, max_length: Optional[int] = None) -> Optional[str]:
+    """
+    Summarize a document that isn't worth sending to Ollama, or return None.
+    
+    Documents under MIN_SUMMARY_CHARS characters or of at most max_length words
+    are returned as-is. Documents with fewer than MIN_UNIQUE_WORDS distinct
+    words are truncated to max_length words, or to MIN_SUMMARY_CHARS characters
+    without a limit.
+    """
+    if len(text) < MIN_SUMMARY_CHARS:
+        return text.strip()
+    
+    # Scan words lazily and stop as soon as the document exceeds both limits
+    unique_words = set()
+    word_count = 0
+    cut = 0  # End of the last word that fits in a truncated summary
+    for word_count, match in enumerate(WORD_PATTERN.finditer(text), start=1):
+        unique_words.add(match.group())
+        if len(unique_words) >= MIN_UNIQUE_WORDS and (not max_length or word_count > max_length):
+            return None
+        if (word_count <= max_length) if max_length else (match.end() <= MIN_SUMMARY_CHARS):
+            cut = match.end()
+    
+    if max_length and word_count <= max_length:
+        return text.strip()
+    return text[:cut].strip()
+
+
+async def build_summary_prompt(text: str, model: str, max_length: Optional[int] = None) -> Prompt:
+    """
+    Build the prompt for the final summary generation.
+    
+    Long documents are split into chunks that are summarized concurrently
+    (map); the section summaries are summarized again the same way until they
+    fit in a single chunk, which the returned prompt combines (reduce).
+    """
+    length_instruction = json_fragment(f" Keep the summary under {max_length} words.") if max_length else b""
+    chunks = split_text(text)
+    
+    if len(chunks) == 1:
+        return build_prompt(DOCUMENT_PROMPT_PREFIX + length_instruction + DOCUMENT_PROMPT_BODY, text)
+    
+    combined = text
+    while len(chunks) > 1:
+        # Map: summarize every chunk concurrently
+        logger.info(f"Summarizing {len(chunks)} chunks in parallel")
+        section_summaries = await summarize_sections(model, chunks)
         
-        if not summary:
-            raise Exception("Empty response from Ollama")
+        # Section summaries that don't shrink the text would never fit in one chunk
+        previous_length = len(combined)
+        combined = "\n\n".join(section_summaries)
+        if len(combined) >= previous_length:
+            raise Exception("Section summaries are not shorter than the text they summarize")
+        chunks = split_text(combined)
+    
+    # Reduce: combine the section summaries into the final summary
+    return build_prompt(REDUCE_PROMPT_PREFIX + length_instruction + REDUCE_PROMPT_BODY, combined)
+
+
+async def summarize_sections(model: str, chunks: List[str]) -> List[str]:
+    """Summarize chunks concurrently, cancelling the remaining calls if one fails"""
+    tasks = [
+        asyncio.create_task(ollama_generate(model, build_prompt(SECTION_PROMPT_PREFIX, chunk)))
+        for chunk in chunks
+    ]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+def build_prompt(instruction: bytes, text: str) -> Prompt:
+    """
+    Escape the text for a prompt made of a pre-escaped instruction, the text and
+    the summary cue, leaving the pieces to be joined into the request body.
+    """
+    # Slice the escaped text out of its quotes without copying it
+    return instruction, memoryview(json_string(text))[1:-1], PROMPT_SUFFIX
+
+
+def build_generate_body(model: str, prompt: Prompt, stream: bool) -> bytes:
+    """Build the /api/generate JSON request body around an escaped prompt"""
+    # The only copy of the escaped text: httpx sends bytes as a single sized body
+    return b"".join((
+        b'{"model":',
+        orjson.dumps(model),
+        b',"stream":true,"prompt":"' if stream else b',"stream":false,"prompt":"',
+        *prompt,
+        b'"}'
+    ))
+
+
+async def stream_summary(
+    tokens: AsyncGenerator[str, None],
+    first_token: str,
+    cache_key: tuple,
+    original_length: int
+) -> AsyncIterator[str]:
+    """Relay Ollama tokens to the client and cache the completed summary"""
+    # Unbounded queue between the Ollama reader and the HTTP writer so a
+    # stalled client never holds an Ollama slot; a summary is small anyway
+    queue: asyncio.Queue = asyncio.Queue()
+    
+    async def read_tokens():
+        try:
+            async for token in tokens:
+                queue.put_nowait(token)
+        except Exception as e:
+            queue.put_nowait(e)
+        else:
+            queue.put_nowait(None)
+    
+    reader = asyncio.create_task(read_tokens())
+    summary_tokens = [first_token]
+    try:
+        yield first_token
+        while (item := await queue.get()) is not None:
+            if isinstance(item, Exception):
+                # Headers are already sent, so flag the failure in the body
+                logger.error(f"Summary generation error: {item}")
+                yield f"\n\n[Summary generation failed: {item}]\n"
+                return
+            summary_tokens.append(item)
+            yield item
         
-        return summary
+        summary = "".join(summary_tokens).strip()
+        if summary:
+            await cache_set(cache_key, {
+                "original_length": original_length,
+                "summary": summary
+            })
+    finally:
+        # Let the reader unwind before closing the Ollama stream and its slot
+        reader.cancel()
+        await asyncio.gather(reader, return_exceptions=True)
+        await tokens.aclose()
+
+
+async def ollama_generate(model: str, prompt: Prompt) -> str:
+    """Run a single Ollama generation and return the response text"""
+    async with OLLAMA_SEMAPHORE:
+        response = await app.state.http.post(
+            "/api/generate",
+            content=build_generate_body(model, prompt, stream=False),
+            headers=JSON_HEADERS
+        )
+    
+    if response.status_code != 200:
+        error_msg = response.text
+        logger.error(f"Ollama API error: {error_msg}")
+        raise Exception(f"Ollama API returned status {response.status_code}: {error_msg}")
+    
+    result = response.json()
+    summary = result.get("response", "").strip()
+    
+    if not summary:
+        raise Exception("Empty response from Ollama")
+    
+    return summary
+
+
+async def ollama_generate_stream(model: str, prompt: Prompt) -> AsyncIterator[str]:
+    """Run a single streaming Ollama generation, yielding response tokens as they arrive"""
+    async with OLLAMA_SEMAPHORE:
+        async with app.state.http.stream(
+            "POST",
+            "/api/generate",
+            content=build_generate_body(model, prompt, stream=True),
+            headers=JSON_HEADERS
+        ) as response:
+            if response.status_code != 200:
+                error_msg = (await response.aread()).decode(errors="replace")
+                logger.error(f"Ollama API error: {error_msg}")
+                raise Exception(f"Ollama API returned status {response.status_code}: {error_msg}")
+            
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                result = json.loads(line)
+                if "error" in result:
+                    logger.error(f"Ollama API error: {result['error']}")
+                    raise Exception(f"Ollama API error: {result['error']}")
+                token = result.get("response")
+                if token:
+                    yield token
+                if result.get("done"):
+                    return
+            
+            # A stream cut off before the "done" line holds a truncated summary
+            logger.error("Ollama stream ended before the summary was complete")
+            raise Exception("Ollama stream ended before the summary was complete")
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    
+    # libuv-based event loop and C HTTP parser, both installed by uvicorn[standard]
+    try:
+        import uvloop  # noqa: F401
+        loop = "uvloop"
+    except ImportError:
+        loop = "asyncio"  # uvloop is not available on Windows
+    
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop=loop, http="httptools")
 
@@ -0,0 +1,18 @@
+"""
+Optional native build of the document parser.
+
+Compiles document_parser.py to a C extension with mypyc so the per-page and
+per-paragraph extraction loops run without interpreter overhead. The pure
+Python module keeps working when the extension is not built.
+
+    pip install mypy
+    python setup.py build_ext --inplace
+"""
+from setuptools import setup
+from mypyc.build import mypycify
+
+setup(
+    name="deepdocai-parser",
+    py_modules=["document_parser"],
+    ext_modules=mypycify(["document_parser.py"]),
+)